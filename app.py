@@ -1,15 +1,29 @@
-from flask import Flask, render_template, url_for, redirect, request, flash, Response
+from flask import Flask, render_template, url_for, redirect, request, flash, g, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin, login_user, LoginManager, login_required, logout_user, current_user
 from flask_bcrypt import Bcrypt
+from flask_caching import Cache
+from argon2 import PasswordHasher
+from argon2.exceptions import VerifyMismatchError, InvalidHashError
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField
 from wtforms.validators import InputRequired, Length, ValidationError
+from collections import defaultdict
 from datetime import date, datetime
 from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+import csv
+import io
 import os
 from dotenv import load_dotenv
 
+try:
+    import numpy as np
+except ImportError:
+    # optional; only used to speed up chart rounding for very large result sets
+    np = None
+
 # load .env file
 load_dotenv()
 
@@ -18,8 +32,18 @@ app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv("DATABASE_URI")
 app.config['SECRET_KEY'] = os.getenv("FLASK_SECRET_KEY")
 
+# explicit pool sizing (gunicorn workers each get their own pool) plus a
+# larger compiled-statement cache so warm requests skip SQL compilation;
+# sqlite's thread-local pools don't take the sizing knobs
+engine_options = {'pool_pre_ping': True, 'pool_recycle': 1800, 'query_cache_size': 1200}
+if not (os.getenv("DATABASE_URI") or '').startswith('sqlite'):
+    engine_options.update({'pool_size': 10, 'max_overflow': 20})
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+
 db = SQLAlchemy(app)
 bcrypt = Bcrypt(app)
+cache = Cache(app, config={'CACHE_TYPE': 'SimpleCache'})
+ph = PasswordHasher()
 
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -27,10 +51,16 @@ login_manager.login_view = "login"
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return db.session.get(User, int(user_id))
 
 CATEGORIES = ['Food', 'Transport', 'Entertainment', 'Utilities', 'Health', 'Subscriptions', 'Other']
 
+@app.before_request
+def set_today():
+    # computed once per request; views pass it to templates as the
+    # default date for the expense forms
+    g.today_iso = date.today().isoformat()
+
 class Category(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), nullable=False)
@@ -38,11 +68,18 @@ class Category(db.Model):
     expenses = db.relationship('Expense', backref='category', lazy=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
 
+    # also backs the name+user lookups in add_expense/edit_expense/add_category
+    __table_args__ = (db.UniqueConstraint('user_id', 'name', name='uq_category_user_name'),)
+
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(20), unique=True, nullable=False)
     password = db.Column(db.String(128), nullable=False)
     name = db.Column(db.String(20), nullable=True)
+    # bumped on every expense mutation; keys the cached chart aggregates
+    expenses_version = db.Column(db.Integer, nullable=False, default=0)
+    # likewise for category mutations; keys the cached category list
+    categories_version = db.Column(db.Integer, nullable=False, default=0)
 
 class RegistrationForm(FlaskForm):
     username = StringField(validators=[InputRequired(), Length(min=4, max=20)], render_kw={"placeholder": "Username"})
@@ -50,10 +87,24 @@ class RegistrationForm(FlaskForm):
     submit = SubmitField("Register")
 
     def validate_username(self, username):
-        existing_user = User.query.filter_by(username=username.data).first()
+        existing_user = db.session.scalars(db.select(User).filter_by(username=username.data)).first()
         if existing_user:
             raise ValidationError("That username already exists. Please choose a different one.")
 
+def check_password(user, password):
+    # verify against argon2; fall back to bcrypt for accounts created
+    # before the switch and upgrade their hash on successful login
+    try:
+        ph.verify(user.password, password)
+    except VerifyMismatchError:
+        return False
+    except InvalidHashError:
+        if not bcrypt.check_password_hash(user.password, password):
+            return False
+        user.password = ph.hash(password)
+        db.session.commit()
+    return True
+
 class LoginForm(FlaskForm):
     username = StringField(validators=[InputRequired(), Length(min=4, max=20)], render_kw={"placeholder": "Username"})
     password = PasswordField(validators=[InputRequired(), Length(min=4, max=20)], render_kw={"placeholder": "Password"})
@@ -71,6 +122,13 @@ class Expense(db.Model):
     date = db.Column(db.Date, nullable=False, default=date.today)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
 
+    # dashboard/export filter by user + date range (ordered by date) and the
+    # charts group by date and category, so index both combinations
+    __table_args__ = (
+        db.Index('ix_expense_user_date', 'user_id', 'date'),
+        db.Index('ix_expense_user_cat', 'user_id', 'category_id'),
+    )
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -79,8 +137,8 @@ def index():
 def login():
     form = LoginForm()
     if form.validate_on_submit():
-        user = User.query.filter_by(username=form.username.data).first()
-        if user and bcrypt.check_password_hash(user.password, form.password.data):
+        user = db.session.scalars(db.select(User).filter_by(username=form.username.data)).first()
+        if user and check_password(user, form.password.data):
             login_user(user)
             if not user.name:
                 return redirect(url_for('customize'))
@@ -92,15 +150,18 @@ def login():
 @app.route('/register', methods=['GET', 'POST'])
 def register():
     form = RegistrationForm()
-    existing_user = User.query.filter_by(username=form.username.data).first()
-    if existing_user:
-        flash("Username already taken. Please choose another.", "danger")
-        return redirect(url_for('register'))
     if form.validate_on_submit():
-        hashed_password = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
+        hashed_password = ph.hash(form.password.data)
         new_user = User(username=form.username.data, password=hashed_password)
         db.session.add(new_user)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # lost a race with a concurrent registration; the unique
+            # index on username is the real guard
+            db.session.rollback()
+            flash("Username already taken. Please choose another.", "danger")
+            return redirect(url_for('register'))
         init_categories_for_user(new_user.id)
         return redirect(url_for('login'))
     return render_template('register.html', form=form)
@@ -123,41 +184,119 @@ def parse_date(s: str):
     except ValueError:
         return None
 
+def apply_filters(q, args):
+    # Apply the date/amount/category filters from the given query-string
+    # args to q. Shared by dashboard and export_csv so both stay in sync
+    # and any query tweak (indexes, loader options, pushdowns) lands once.
+    start_date = parse_date((args.get('start') or '').strip())
+    end_date = parse_date((args.get('end') or '').strip())
+
+    if start_date:
+        q = q.filter(Expense.date >= start_date)
+    if end_date:
+        q = q.filter(Expense.date <= end_date)
+
+    min_amount = (args.get('min_amount') or '').strip()
+    max_amount = (args.get('max_amount') or '').strip()
+
+    if min_amount:
+        q = q.filter(Expense.amount >= float(min_amount))
+    if max_amount:
+        q = q.filter(Expense.amount <= float(max_amount))
+
+    filter_category = (args.get('filter_category') or '').strip()
+    if filter_category:
+        q = q.join(Category).filter(Category.name == filter_category)
+
+    return q
+
+def round2(sums):
+    # vectorized rounding only pays off on big result sets; for typical
+    # chart sizes the plain list comprehension wins
+    if np is not None and len(sums) > 1000:
+        return np.round(np.asarray([float(s or 0) for s in sums], dtype=np.float64), 2).tolist()
+    return [round(float(s or 0), 2) for s in sums]
+
+@cache.memoize(timeout=300)
+def get_chart_data(user_id, version):
+    # version only keys the cache entry; it's bumped on every expense
+    # mutation so stale aggregates are never served
+    # one GROUP BY over (category, date) scans the user's expenses once;
+    # both charts are then bucketed from the small grouped result.
+    # outer join so uncategorized expenses still count toward the day chart
+    rows = db.session.execute(
+        db.select(Category.name, Expense.date, func.sum(Expense.amount))
+        .outerjoin(Category, Expense.category_id == Category.id)
+        .filter(Expense.user_id == user_id)
+        .group_by(Category.name, Expense.date)
+    ).all()
+
+    by_cat = defaultdict(float)
+    by_day = defaultdict(float)
+    for cat_name, day, s in rows:
+        amount = float(s or 0)
+        if cat_name is not None:
+            by_cat[cat_name] += amount
+        by_day[day] += amount
+
+    cat_labels = list(by_cat)
+    cat_values = round2(list(by_cat.values()))
+    days = sorted(by_day)
+    day_labels = [d.isoformat() for d in days]
+    day_values = round2([by_day[d] for d in days])
+
+    return cat_labels, cat_values, day_labels, day_values
+
+def bump_expenses_version():
+    # invalidates the cached chart aggregates for the current user
+    current_user.expenses_version = (current_user.expenses_version or 0) + 1
+
+@cache.memoize(timeout=3600)
+def get_categories(user_id, version):
+    # (id, name) tuples rather than ORM objects so cached entries don't
+    # hold detached instances across requests
+    return [
+        (c.id, c.name)
+        for c in db.session.scalars(
+            db.select(Category).filter_by(user_id=user_id).order_by(Category.name)
+        )
+    ]
+
+def bump_categories_version():
+    # invalidates the cached category list for the current user
+    current_user.categories_version = (current_user.categories_version or 0) + 1
+
 @app.route('/dashboard')
 @login_required
 def dashboard():
     # Check if user wants to clear filters
     clear_filters = request.args.get('clear_filters') == 'true'
-    
-	# Categories chart
-    cat_rows = (
-        db.session.query(Category.name, func.sum(Expense.amount))
-        .join(Category, Expense.category_id == Category.id)
-        .filter(Expense.user_id == current_user.id)
-        .group_by(Category.name)
-        .all()
-	)
-    cat_labels = [c for c, _ in cat_rows]
-    cat_values = [round(float((s or 0)), 2) for _, s in cat_rows]
-    
-	# Day chart
-    day_q = (
-        db.session.query(Expense.date, func.sum(Expense.amount))
-        .filter(Expense.user_id == current_user.id)
-	)
-    day_rows = day_q.group_by(Expense.date).all()
-    day_labels = [d.isoformat() for d, _ in day_rows]
-    day_values = [round(float((s or 0)), 2) for _, s in day_rows]
+
+    # charts (cached per user until their expenses change)
+    cat_labels, cat_values, day_labels, day_values = get_chart_data(
+        current_user.id, current_user.expenses_version or 0
+    )
 
     if clear_filters:
         # Just return all expenses for current user
-        expenses = Expense.query.filter_by(user_id=current_user.id).order_by(Expense.date.desc()).all()
-        categories = Category.query.filter_by(user_id=current_user.id).all()
-        total = round(sum(e.amount for e in expenses), 2)
+        pagination = db.paginate(
+            db.select(Expense)
+            .options(joinedload(Expense.category))
+            .filter_by(user_id=current_user.id)
+            .order_by(Expense.date.desc()),
+            page=request.args.get('page', 1, type=int), per_page=50, error_out=False
+        )
+        expenses = pagination.items
+        categories = get_categories(current_user.id, current_user.categories_version or 0)
+        total = round(float(db.session.scalar(
+            db.select(func.coalesce(func.sum(Expense.amount), 0))
+            .filter(Expense.user_id == current_user.id)
+        )), 2)
         return render_template(
             'dashboard.html',
             name=current_user.name,
             expenses=expenses,
+            pagination=pagination,
             categories=categories,
             total=total,
             start='',
@@ -165,7 +304,7 @@ def dashboard():
             min='',
             max='',
             selected_category='',
-            today=date.today().isoformat(),
+            today=g.today_iso,
         	cat_labels=cat_labels,
 			cat_values=cat_values,
         	day_labels=day_labels,
@@ -175,42 +314,37 @@ def dashboard():
     # otherwise, handle normal filters below
     start_str = (request.args.get('start') or '').strip()
     end_str = (request.args.get('end') or '').strip()
-    start_date = parse_date(start_str)
-    end_date = parse_date(end_str)
-    selected_category = (request.args.get('filter_category') or '').strip()
-
-    q = Expense.query.filter_by(user_id=current_user.id)
-
-    if start_date:
-        q = q.filter(Expense.date >= start_date)
-    if end_date:
-        q = q.filter(Expense.date <= end_date)
-
     min_amount = (request.args.get('min_amount') or '').strip()
     max_amount = (request.args.get('max_amount') or '').strip()
-
-    if min_amount:
-        q = q.filter(Expense.amount >= float(min_amount))
-    if max_amount:
-        q = q.filter(Expense.amount <= float(max_amount))
-
     selected_category = (request.args.get('filter_category') or '').strip()
- 
-    if selected_category:
-        q = q.join(Category).filter(Category.name == selected_category)
 
+    # eager-load categories so the table renders from one JOIN instead of N+1 lazy loads,
+    # and paginate so the page payload stays bounded no matter how much history a user has
+    q = apply_filters(
+        db.select(Expense).options(joinedload(Expense.category)).filter_by(user_id=current_user.id),
+        request.args
+    )
+    pagination = db.paginate(
+        q.order_by(Expense.date.desc()),
+        page=request.args.get('page', 1, type=int), per_page=50, error_out=False
+    )
+    expenses = pagination.items
 
-    expenses = q.order_by(Expense.date.desc()).all()
-    total = round(sum(e.amount for e in expenses), 2)
+    # sum in the database so only a scalar comes back, not every row
+    total_q = apply_filters(
+        db.select(func.coalesce(func.sum(Expense.amount), 0))
+        .filter(Expense.user_id == current_user.id),
+        request.args
+    )
+    total = round(float(db.session.scalar(total_q)), 2)
 
-    categories = Category.query.filter_by(user_id=current_user.id).all()
-    
-    print(expenses)
+    categories = get_categories(current_user.id, current_user.categories_version or 0)
 
     return render_template(
         'dashboard.html',
         name=current_user.name,
         expenses=expenses,
+        pagination=pagination,
         categories=categories,
         total=total,
         start=start_str,
@@ -218,7 +352,7 @@ def dashboard():
         min=min_amount,
         max=max_amount,
         selected_category=selected_category,
-        today=date.today().isoformat(),
+        today=g.today_iso,
         cat_labels=cat_labels,
 		cat_values=cat_values,
         day_labels=day_labels,
@@ -228,7 +362,7 @@ def dashboard():
 @app.route('/edit_categories')
 @login_required
 def manage_categories():
-    categories = Category.query.filter_by(user_id=current_user.id).order_by(Category.name).all()
+    categories = get_categories(current_user.id, current_user.categories_version or 0)
     return render_template('manage_cats.html', categories=categories)
 
 @app.route('/edit_categories/add', methods=['POST'])
@@ -240,9 +374,8 @@ def add_category():
         flash("Name cannot be empty.", "error")
         return redirect(url_for('manage_categories'))
     
-    existing = Category.query.filter_by(
-        name=new_name,
-        user_id=current_user.id
+    existing = db.session.scalars(
+        db.select(Category).filter_by(name=new_name, user_id=current_user.id)
     ).first()
 
     # Check for duplicates
@@ -253,7 +386,15 @@ def add_category():
 
     cat = Category(name=new_name, user_id=current_user.id)
     db.session.add(cat)
-    db.session.commit()
+    bump_categories_version()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # lost a race with a concurrent add; the unique index on
+        # (user_id, name) is the real guard
+        db.session.rollback()
+        flash("Category with this name already exists.", "error")
+        return redirect(url_for('manage_categories'))
     flash("Category added!", "success")
     return redirect(url_for('manage_categories'))
 
@@ -261,16 +402,15 @@ def add_category():
 @login_required
 def edit_category(cat_id):
     new_name = request.form.get("name", "").strip()
-    cat = Category.query.get_or_404(cat_id)
+    cat = db.one_or_404(db.select(Category).filter_by(id=cat_id, user_id=current_user.id))
 
     if not new_name:
         flash("Name cannot be empty.", "error")
         return redirect(url_for('manage_categories'))
 
-    existing = Category.query.filter_by(
-        name=new_name,
-        user_id=current_user.id
-	).first()
+    existing = db.session.scalars(
+        db.select(Category).filter_by(name=new_name, user_id=current_user.id)
+    ).first()
 
 	# Check for duplicates
 
@@ -278,7 +418,13 @@ def edit_category(cat_id):
         flash("Category with this name already exists.", "error")
 
     cat.name = new_name
-    db.session.commit()
+    bump_categories_version()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        flash("Category with this name already exists.", "error")
+        return redirect(url_for('manage_categories'))
     flash("Category renamed!", "success")
     return redirect(url_for('manage_categories'))
 
@@ -286,14 +432,17 @@ def edit_category(cat_id):
 @app.route('/edit_categories/<int:cat_id>/delete', methods=['POST'])
 @login_required
 def delete_category(cat_id):
-    cat = Category.query.get_or_404(cat_id)
+    cat = db.one_or_404(db.select(Category).filter_by(id=cat_id, user_id=current_user.id))
 
-    # prevent deletion if cat is in use
-    if cat.expenses:
+    # prevent deletion if cat is in use; EXISTS stops at the first match
+    # instead of lazy-loading every expense in the category
+    in_use = db.session.scalar(db.select(db.exists().where(Expense.category_id == cat.id)))
+    if in_use:
         flash("Cannot delete a category that is in use.", "error")
         return redirect(url_for('edit_category', cat_id=cat.id))
 
     db.session.delete(cat)
+    bump_categories_version()
     db.session.commit()
     flash("Category deleted!", "success")
     return redirect(url_for('manage_categories', cat_id=cat.id))
@@ -334,7 +483,9 @@ def add_expense():
         flash('Invalid expense data. Please try again.', 'error')
         return redirect(url_for('dashboard'))
 
-    category = Category.query.filter_by(name=category_name, user_id=current_user.id).first()
+    category = db.session.scalars(
+        db.select(Category).filter_by(name=category_name, user_id=current_user.id)
+    ).first()
     if not category:
         flash("Invalid category", "error")
         return redirect(url_for('dashboard'))
@@ -348,6 +499,7 @@ def add_expense():
     )
 
     db.session.add(new_expense)
+    bump_expenses_version()
     db.session.commit()
     flash('Expense added successfully!', 'success')
     return redirect(url_for('dashboard'))
@@ -355,8 +507,9 @@ def add_expense():
 @app.route('/delete/<int:expense_id>', methods=['POST'])
 @login_required
 def delete_expense(expense_id):
-	expense = Expense.query.get_or_404(expense_id)
+	expense = db.one_or_404(db.select(Expense).filter_by(id=expense_id, user_id=current_user.id))
 	db.session.delete(expense)
+	bump_expenses_version()
 	db.session.commit()
 	flash('Expense deleted successfully!', 'success')
 	return redirect(url_for('dashboard'))
@@ -364,7 +517,7 @@ def delete_expense(expense_id):
 @app.route('/edit/<int:expense_id>', methods=['GET', 'POST'])
 @login_required
 def edit_expense(expense_id):
-    expense = Expense.query.get_or_404(expense_id)
+    expense = db.one_or_404(db.select(Expense).filter_by(id=expense_id, user_id=current_user.id))
 
     if request.method == 'POST':
 
@@ -372,7 +525,9 @@ def edit_expense(expense_id):
 
         # handle category name to category object
         category_name = (request.form.get('category') or expense.category.name).strip()
-        category_obj = Category.query.filter_by(name=category_name, user_id=current_user.id).first()
+        category_obj = db.session.scalars(
+            db.select(Category).filter_by(name=category_name, user_id=current_user.id)
+        ).first()
         if not category_obj:
             flash("Invalid category.", "error")
             return redirect(url_for('edit_expense', expense_id=expense.id))
@@ -407,6 +562,7 @@ def edit_expense(expense_id):
         expense.date = date_exp
         expense.category_id = category_obj.id
 
+        bump_expenses_version()
         db.session.commit()
         flash("Expense updated successfully!", "success")
         return redirect(url_for('dashboard'))
@@ -415,8 +571,8 @@ def edit_expense(expense_id):
     return render_template(
         'edit_expense.html',
         e=expense,
-        categories = Category.query.filter_by(user_id=current_user.id).all(),
-        today=date.today().isoformat()
+        categories = get_categories(current_user.id, current_user.categories_version or 0),
+        today=g.today_iso
     )
 
 
@@ -425,43 +581,36 @@ def edit_expense(expense_id):
 def export_csv():
     start_str = (request.args.get('start') or '').strip()
     end_str = (request.args.get('end') or '').strip()
-    start_date = parse_date(start_str)
-    end_date = parse_date(end_str)
-    
-    q = Expense.query.filter_by(user_id=current_user.id)
-
-    if start_date:
-        q = q.filter(Expense.date >= start_date)
-    if end_date:
-        q = q.filter(Expense.date <= end_date)
-
-    min_amount = (request.args.get('min_amount') or '').strip()
-    max_amount = (request.args.get('max_amount') or '').strip()
 
-    if min_amount:
-        q = q.filter(Expense.amount >= float(min_amount))
-    if max_amount:
-        q = q.filter(Expense.amount <= float(max_amount))
+    # eager-load categories so the row loop below doesn't do one SELECT per expense
+    q = apply_filters(
+        db.select(Expense).options(joinedload(Expense.category)).filter_by(user_id=current_user.id),
+        request.args
+    )
 
-    filter_category = (request.args.get('filter_category') or '').strip()
-    if filter_category:
-        q = q.filter(Category.name == filter_category)
- 
+    q = q.order_by(Expense.date.desc())
+
+    # stream row by row instead of building the whole CSV in memory;
+    # yield_per keeps the result set windowed so big exports stay O(1).
+    # csv.writer handles quoting, so descriptions with commas/quotes
+    # no longer corrupt the output; the StringIO is reused per row
+    def generate():
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(['date', 'description', 'category', 'amount'])
+        yield buf.getvalue()
+        for e in db.session.scalars(q.execution_options(yield_per=1000)):
+            buf.seek(0)
+            buf.truncate()
+            writer.writerow([e.date.isoformat(), e.description, e.category.name, f"{e.amount:.2f}"])
+            yield buf.getvalue()
 
-    expenses = q.order_by(Expense.date.desc()).all()
-    
-    lines = ['date,description,category,amount']
-    
-    for e in expenses:
-        lines.append(f"{e.date.isoformat()}, {e.description}, {e.category.name}, {e.amount:.2f}")
-    csv_data = '\n'.join(lines)
-    
     fname_start = start_str or 'all'
     fname_end = end_str or 'all'
     filename = f"expenses_{fname_start}_to_{fname_end}.csv"
-    
+
     return Response(
-        csv_data,
+        stream_with_context(generate()),
         headers={
             "Content-Type": "text/csv",
             "Content-Disposition": f"attachment; filename={filename}"
@@ -471,15 +620,62 @@ def export_csv():
 def init_categories_for_user(user_id):
     default_categories = ["Food", "Rent", "Utilities", "Entertainment", "Transportation", "Subscriptions"]
 
-    for cat_name in default_categories:
-        exists = Category.query.filter_by(name=cat_name, user_id=user_id).first()
-        if not exists:
-            new_cat = Category(name=cat_name, user_id=user_id)
-            db.session.add(new_cat)
+    # only called for freshly registered users, so no per-name existence
+    # checks needed; one bulk INSERT instead of 6 SELECTs + 6 INSERTs
+    db.session.bulk_save_objects(
+        [Category(name=cat_name, user_id=user_id) for cat_name in default_categories]
+    )
     db.session.commit()
 
     
+@app.cli.command("init-db")
+def init_db():
+    """Create the database tables (one-time setup)."""
+    db.create_all()
+    print("Initialized the database.")
+
+
+@app.cli.command("upgrade-db")
+def upgrade_db():
+    """Apply in-place schema upgrades to an existing database."""
+    inspector = db.inspect(db.engine)
+
+    # the version counters were added after the initial schema shipped;
+    # create_all never ALTERs existing tables, so add the columns here
+    # ("user" is quoted because it's reserved in Postgres)
+    user_columns = {col['name'] for col in inspector.get_columns('user')}
+    for column in ('expenses_version', 'categories_version'):
+        if column not in user_columns:
+            db.session.execute(db.text(
+                f'ALTER TABLE "user" ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0'
+            ))
+            print(f"Added user.{column}.")
+
+    # the composite expense indexes likewise only apply to freshly
+    # created tables
+    expense_indexes = {ix['name'] for ix in inspector.get_indexes('expense')}
+    for index_name, columns in (
+        ('ix_expense_user_date', 'user_id, date'),
+        ('ix_expense_user_cat', 'user_id, category_id'),
+    ):
+        if index_name not in expense_indexes:
+            db.session.execute(db.text(f'CREATE INDEX {index_name} ON expense ({columns})'))
+            print(f"Created {index_name}.")
+
+    # enforce category (user_id, name) uniqueness via a unique index,
+    # which works in place on sqlite where ADD CONSTRAINT does not;
+    # fails if existing duplicate names need cleaning up first
+    category_indexes = {ix['name'] for ix in inspector.get_indexes('category')}
+    category_uniques = {uc['name'] for uc in inspector.get_unique_constraints('category')}
+    if 'uq_category_user_name' not in category_indexes and not category_uniques:
+        db.session.execute(db.text(
+            'CREATE UNIQUE INDEX uq_category_user_name ON category (user_id, name)'
+        ))
+        print("Created uq_category_user_name.")
+
+    db.session.commit()
+    print("Database upgrade complete.")
+
+
 if __name__ == "__main__":
-    with app.app_context():
-        db.create_all()
     app.run(debug=True)